@@ -1,12 +1,15 @@
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from typing import Optional
-import os
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional, List, Dict, Any, AsyncIterator
+import json
+import time
+import asyncio
 import logging
 from dotenv import load_dotenv
-from groq import Groq
 from ...services.search import search_similar
-from ...services.synthesis import summarize_themes
+from ...services.synthesis import stream_themes
+from ...services.semantic_cache import semantic_cache
+from ...services.query_batcher import query_batcher
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -14,23 +17,58 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize GROQ client with API key from environment
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY environment variable is not set")
-client = Groq(
-    api_key=api_key,
-    base_url="https://api.groq.com/v1"
-)
-
 query_router = APIRouter()
 
+# Streamed tokens are sent in small batches rather than one event per token
+STREAM_FLUSH_TOKENS = 16
+STREAM_FLUSH_SECONDS = 0.025
+
+def _sse(event: Dict[str, Any]) -> str:
+    """Format an event as a server-sent event."""
+    return f"data: {json.dumps(event)}\n\n"
+
+async def _stream_answer(q: str, source: Optional[str], query_embedding, results: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """
+    Relay the streamed completion as batched SSE "delta" events, ending with one
+    event that holds the formatted answer and its sources.
+    """
+    buffer = []
+    last_flush = time.monotonic()
+    async for event in stream_themes(results, query=q):
+        if "delta" in event:
+            buffer.append(event["delta"])
+            if len(buffer) >= STREAM_FLUSH_TOKENS or time.monotonic() - last_flush >= STREAM_FLUSH_SECONDS:
+                yield _sse({"delta": "".join(buffer)})
+                buffer = []
+                last_flush = time.monotonic()
+            continue
+
+        if buffer:
+            yield _sse({"delta": "".join(buffer)})
+            buffer = []
+        # Only cache real answers, not errors or "no information" fallbacks
+        if "error" not in event and event["sources"]:
+            semantic_cache.add(query_embedding, event["answer"], event["sources"], source=source)
+        yield _sse({"question": q, **event})
+
 @query_router.get('/')
-def ask_question(q: str, source: Optional[str] = None):
-    # print(f"Received query: {q}, source: {source}")
+async def ask_question(q: str, source: Optional[str] = None):
     try:
-        results = search_similar(q, source=source)
-        # print(f"Search results: {results}")
+        # Answer paraphrases of previous questions straight from the cache
+        # Concurrent questions share one encoder call
+        query_embedding = await query_batcher.encode(q)
+        cached = semantic_cache.lookup(query_embedding, source=source)
+        if cached:
+            return StreamingResponse(
+                iter([_sse({"question": q, "answer": cached["answer"], "sources": cached["sources"]})]),
+                media_type="text/event-stream"
+            )
+
+        # Retrieve the context before streaming starts so the first token isn't delayed by search.
+        # The embedding computed for the cache lookup is reused instead of encoding the query again.
+        results = await asyncio.to_thread(
+            search_similar, q, source=source, query_embedding=query_embedding.tolist()
+        )
         
         if isinstance(results, dict) and results.get("status") == "error":
             return JSONResponse(
@@ -43,19 +81,11 @@ def ask_question(q: str, source: Optional[str] = None):
                 status_code=500,
                 content={"error": "Invalid format for search results."}
             )
-        # print(f"Results---: {results}")
 
-        
-        # After getting results
-        context = "\n".join([r["content"] for r in results])
-        summary = summarize_themes(results, query=q)
-
-        # Only return sources once
-        return {
-            "question": q,
-            "answer": summary["answer"],
-            "sources": summary["sources"]
-        }
+        return StreamingResponse(
+            _stream_answer(q, source, query_embedding, results),
+            media_type="text/event-stream"
+        )
     except Exception as ex:
         return JSONResponse(
             status_code=500,
@@ -2,19 +2,19 @@ import os
 import hashlib
 import logging
 import asyncio
-import re
-from typing import List, Dict, Any
+import multiprocessing
+import aiofiles.tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
-from ...services.ocr_service import extract_text_from_file
-from ...services.vector_store import store_text_chunks
+from ...services.ocr_service import extract_text_from_file, init_ocr_worker, OCR_PROCESSES
+from ...services.chunking import chunk_text
+from ...services.vector_store import store_text_chunks_batch, INGEST_POOL
+from ...services.semantic_cache import semantic_cache
+from ...db.manifest import get_document, record_document
 from app.core.config import settings  # Correct import for settings
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 upload_router = APIRouter()
@@ -22,7 +22,16 @@ upload_router = APIRouter()
 # Constants
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 ALLOWED_EXTENSIONS = {'.pdf', '.txt', '.doc', '.docx', '.jpg', '.png'}
-CHUNK_SIZE = 800  # Use fixed chunk size for all files
+UPLOAD_READ_SIZE = 64 * 1024  # 64KB
+
+# Text extraction is CPU-bound, so it runs in worker processes shared by all uploads
+# instead of blocking the event loop. "spawn" keeps the workers free of the parent's
+# threads and loaded models, and behaves the same on Windows and Linux.
+OCR_POOL = ProcessPoolExecutor(
+    max_workers=OCR_PROCESSES,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_ocr_worker
+)
 
 def is_valid_file(file: UploadFile) -> bool:
     """
@@ -39,79 +48,47 @@ def is_valid_file(file: UploadFile) -> bool:
         logger.error(f"Error validating file {file.filename}: {str(e)}")
         return False
 
-def get_file_hash(content: bytes) -> str:
+async def save_upload(file: UploadFile, upload_dir: str = "uploads") -> Optional[Tuple[str, str]]:
     """
-    Generate SHA-256 hash of file content to prevent duplicates.
+    Stream an upload to disk in fixed-size reads, hashing it with SHA-256 on the way
+    so the stored filename can be used to prevent duplicates.
+    Returns (file_hash, file_path), or None if the file exceeds MAX_FILE_SIZE.
     """
-    return hashlib.sha256(content).hexdigest()
+    hasher = hashlib.sha256()
+    size = 0
+    async with aiofiles.tempfile.NamedTemporaryFile("wb", dir=upload_dir, delete=False) as tmp:
+        tmp_path = tmp.name
+        try:
+            while chunk := await file.read(UPLOAD_READ_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    break
+                hasher.update(chunk)
+                await tmp.write(chunk)
+        except Exception:
+            await tmp.close()
+            os.remove(tmp_path)
+            raise
 
-def chunk_text(text: str, source: str, chunk_size: int = CHUNK_SIZE, overlap: int = 20) -> List[Dict[str, Any]]:
-    """
-    Splits extracted text into sentence-based chunks with overlap for better semantic retrieval.
-    Each chunk is ~chunk_size words, but never splits a sentence. Overlap is in sentences.
-    """
-    try:
-        # Split by paragraphs first
-        paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
-        chunks = []
-        chunk_index = 0
-        for para in paragraphs:
-            # Split paragraph into sentences
-            sentences = re.split(r'(?<=[.!?]) +', para)
-            current_chunk = []
-            current_len = 0
-            i = 0
-            while i < len(sentences):
-                sentence = sentences[i]
-                words = sentence.split()
-                if current_len + len(words) <= chunk_size or not current_chunk:
-                    current_chunk.append(sentence)
-                    current_len += len(words)
-                    i += 1
-                else:
-                    chunk = " ".join(current_chunk)
-                    chunk_dict = {
-                        "content": chunk,
-                        "meta": {
-                            "source": source,
-                            "chunk_index": chunk_index,
-                            "total_chunks": None  # Set later
-                        }
-                    }
-                    chunks.append(chunk_dict)
-                    chunk_index += 1
-                    # Overlap: start next chunk with last N sentences
-                    current_chunk = current_chunk[-2:] if 2 > 0 else []
-                    current_len = sum(len(s.split()) for s in current_chunk)
-            # Add last chunk in paragraph
-            if current_chunk:
-                chunk = " ".join(current_chunk)
-                chunk_dict = {
-                    "content": chunk,
-                    "meta": {
-                        "source": source,
-                        "chunk_index": chunk_index,
-                        "total_chunks": None
-                    }
-                }
-                chunks.append(chunk_dict)
-                chunk_index += 1
-        # Set total_chunks meta
-        for c in chunks:
-            c["meta"]["total_chunks"] = len(chunks)
-        # Log only summary info, not content
-        if chunks:
-            logger.info(f"Chunked {source}: {len(chunks)} chunks. First chunk preview: '{chunks[0]['content'][:20]}...'")
-        else:
-            logger.info(f"Chunked {source}: No chunks created.")
-        return chunks
-    except Exception as e:
-        logger.error(f"Error chunking text from {source}: {str(e)}")
-        raise ValueError(f"Failed to chunk text: {str(e)}")
+    if size > MAX_FILE_SIZE:
+        os.remove(tmp_path)
+        return None
+
+    file_hash = hasher.hexdigest()
+    ext = os.path.splitext(file.filename)[1]
+    file_path = os.path.join(upload_dir, f"{file_hash}{ext}")
+    # Keep the existing copy if this content was uploaded before
+    if os.path.exists(file_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, file_path)
+    return file_hash, file_path
 
-async def process_single_file(file: UploadFile) -> Dict[str, Any]:
+async def process_single_file(file: UploadFile) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     """
-    Process a single file and return its results.
+    Extract and chunk a single file.
+    Returns the file's result together with its chunks; storing them is left to the caller
+    so chunks from all uploaded files can be embedded in one batch.
     """
     try:
         if not file.filename:
@@ -119,49 +96,54 @@ async def process_single_file(file: UploadFile) -> Dict[str, Any]:
                 "filename": "unknown",
                 "status": "failed",
                 "error": "No filename provided"
-            }
+            }, []
 
         if not is_valid_file(file):
             return {
                 "filename": file.filename,
                 "status": "failed",
                 "error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
-            }
+            }, []
 
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
+        # Save file under a unique filename generated from its hash
+        saved = await save_upload(file)
+        if saved is None:
             return {
                 "filename": file.filename,
                 "status": "failed",
                 "error": f"File too large. Maximum size: {MAX_FILE_SIZE/1024/1024}MB"
-            }
+            }, []
+        file_hash, file_path = saved
 
-        # Generate unique filename using hash
-        file_hash = get_file_hash(content)
-        ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{file_hash}{ext}"
-        file_path = os.path.join("uploads", unique_filename)
-
-        # Save file if it doesn't exist
-        if not os.path.exists(file_path):
-            with open(file_path, "wb") as f:
-                f.write(content)
+        # Skip extraction and embedding for content already ingested under this name
+        ingested = await asyncio.to_thread(get_document, file_hash, file.filename)
+        if ingested:
+            logger.info(f"Skipping {file.filename}: already ingested as {ingested['chunks']} chunks")
+            return {
+                "filename": file.filename,
+                "status": "success",
+                "cached": True,
+                "chunks": ingested["chunks"],
+                "file_hash": file_hash
+            }, []
 
         # Extract text
         logger.info(f"Extracting text from {file.filename}")
-        extracted = extract_text_from_file(file_path)
+        loop = asyncio.get_running_loop()
+        extracted = await loop.run_in_executor(OCR_POOL, extract_text_from_file, file_path)
 
         if not extracted or len(extracted) == 0 or "failed" in str(extracted).lower():
             return {
                 "filename": file.filename,
                 "status": "failed",
                 "error": f"Text extraction failed: {extracted}"
-            }
+            }, []
 
         # Process chunks
         text_chunks = []
         if isinstance(extracted, str):
-            text_chunks = chunk_text(extracted, source=file.filename or "unknown_file")
+            # Tokenizing a large document takes seconds; keep it off the event loop
+            text_chunks = await asyncio.to_thread(chunk_text, extracted, source=file.filename or "unknown_file")
         elif isinstance(extracted, list):
             text_chunks = extracted
         else:
@@ -169,26 +151,23 @@ async def process_single_file(file: UploadFile) -> Dict[str, Any]:
                 "filename": file.filename,
                 "status": "failed",
                 "error": "Unsupported return type from text extraction"
-            }
+            }, []
 
         if not text_chunks:
             return {
                 "filename": file.filename,
                 "status": "failed",
                 "error": "No text could be extracted from the document"
-            }
+            }, []
 
-        # Store chunks
-        result = store_text_chunks(text_chunks)
         # Only log summary, not content
-        logger.info(f"Processed file {file.filename}: {len(text_chunks)} chunks stored.")
+        logger.info(f"Processed file {file.filename}: {len(text_chunks)} chunks extracted.")
         return {
             "filename": file.filename,
             "status": "success",
             "chunks": len(text_chunks),
-            "message": result,
             "file_hash": file_hash
-        }
+        }, text_chunks
 
     except Exception as e:
         logger.error(f"Error processing file {file.filename}: {str(e)}")
@@ -196,7 +175,7 @@ async def process_single_file(file: UploadFile) -> Dict[str, Any]:
             "filename": file.filename,
             "status": "failed",
             "error": str(e)
-        }
+        }, []
 
 @upload_router.post("/")
 async def upload_file(files: List[UploadFile] = File(...)):
@@ -213,7 +192,48 @@ async def upload_file(files: List[UploadFile] = File(...)):
 
         # Process files concurrently
         tasks = [process_single_file(file) for file in files]
-        results = await asyncio.gather(*tasks)
+        outcomes = await asyncio.gather(*tasks)
+        results = [result for result, _ in outcomes]
+
+        # Embed and store the chunks of every successful file in one batch,
+        # storing identical files uploaded together under the same name only once
+        processed = []
+        seen_files = {}
+        for result, chunks in outcomes:
+            if result["status"] != "success" or not chunks:
+                continue
+            key = (result["file_hash"], result["filename"])
+            if key in seen_files:
+                result["cached"] = True
+                result["chunks"] = seen_files[key]
+                continue
+            seen_files[key] = len(chunks)
+            processed.append((result, chunks))
+        all_chunks = [chunk for _, chunks in processed for chunk in chunks]
+        if all_chunks:
+            # Embedding and storing is CPU bound; run it off the event loop
+            storage = await asyncio.get_running_loop().run_in_executor(
+                INGEST_POOL, store_text_chunks_batch, all_chunks
+            )
+            if storage["status"] == "success":
+                # New documents can change the answer to any cached question
+                semantic_cache.clear()
+            offset = 0
+            for result, chunks in processed:
+                if storage["status"] == "success":
+                    await asyncio.to_thread(
+                        record_document, result["file_hash"], result["filename"],
+                        storage["ids"][offset:offset + len(chunks)]
+                    )
+                    offset += len(chunks)
+                    result["message"] = {
+                        "status": "success",
+                        "message": f"Successfully stored {len(chunks)} chunks",
+                        "chunks_stored": len(chunks)
+                    }
+                else:
+                    result["status"] = "failed"
+                    result["error"] = storage["message"]
 
         # Calculate totals
         total_chunks = sum(
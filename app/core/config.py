@@ -1,8 +1,9 @@
 import os
 from pathlib import Path
 from functools import lru_cache
-from pydantic_settings import BaseSettings
+from dataclasses import dataclass
 from configparser import ConfigParser
+from typing import Any
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,32 +12,51 @@ load_dotenv()
 config = ConfigParser()
 config.read(os.path.join(os.path.dirname(__file__), '../config/config.ini'))
 
-class Settings(BaseSettings):
+def _env(name: str, default: Any) -> Any:
+    """Let an environment variable (or .env entry) override a config.ini value, keeping its type."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return type(default)(value)
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    # Values are resolved once at import; instances are immutable plain attributes.
+
     # Paths
     BASE_DIR: Path = Path(__file__).parent.parent
-    UPLOAD_DIR: Path = Path(config.get('DEFAULT', 'UPLOAD_DIR', fallback='uploads'))
-    CHROMA_DB_PATH: Path = Path(config.get('DEFAULT', 'CHROMA_DB_PATH', fallback='chroma_db'))
+    UPLOAD_DIR: Path = _env('UPLOAD_DIR', Path(config.get('DEFAULT', 'UPLOAD_DIR', fallback='uploads')))
+    CHROMA_DB_PATH: Path = _env('CHROMA_DB_PATH', Path(config.get('DEFAULT', 'CHROMA_DB_PATH', fallback='chroma_db')))
     
     # File processing
-    MAX_CHUNK_SIZE: int = 800
-    MAX_FILE_SIZE: int = config.getint('DEFAULT', 'MAX_FILE_SIZE', fallback=52428800)
+    MAX_CHUNK_SIZE: int = _env('MAX_CHUNK_SIZE', 800)
+    MAX_FILE_SIZE: int = _env('MAX_FILE_SIZE', config.getint('DEFAULT', 'MAX_FILE_SIZE', fallback=52428800))
     
     # GROQ
     GROQ_API_KEY: str = os.getenv('GROQ_API_KEY', '')
-    GROQ_MODEL: str = config.get('GROQ', 'MODEL_NAME', fallback='qwen/qwen3-32b')
-    GROQ_MAX_TOKENS: int = config.getint('GROQ', 'MAX_TOKENS', fallback=800)
-    GROQ_TEMPERATURE: float = config.getfloat('GROQ', 'TEMPERATURE', fallback=0.3)
+    GROQ_MODEL: str = _env('GROQ_MODEL', config.get('GROQ', 'MODEL_NAME', fallback='qwen/qwen3-32b'))
+    GROQ_MAX_TOKENS: int = _env('GROQ_MAX_TOKENS', config.getint('GROQ', 'MAX_TOKENS', fallback=800))
+    GROQ_TEMPERATURE: float = _env('GROQ_TEMPERATURE', config.getfloat('GROQ', 'TEMPERATURE', fallback=0.3))
+    CONTEXT_TOKENIZER: str = _env('CONTEXT_TOKENIZER', config.get('GROQ', 'TOKENIZER', fallback='Qwen/Qwen3-32B'))
 
     # Vector DB
-    EMBEDDING_MODEL: str = config.get('VectorDB', 'EMBEDDING_MODEL', fallback='all-MiniLM-L6-v2')
-    BATCH_SIZE: int = config.getint('VectorDB', 'BATCH_SIZE', fallback=32)
+    EMBEDDING_MODEL: str = _env('EMBEDDING_MODEL', config.get('VectorDB', 'EMBEDDING_MODEL', fallback='all-MiniLM-L6-v2'))
+    EMBEDDING_BACKEND: str = _env('EMBEDDING_BACKEND', config.get('VectorDB', 'EMBEDDING_BACKEND', fallback='torch'))
+    EMBEDDING_MODEL_FILE: str = _env('EMBEDDING_MODEL_FILE', config.get('VectorDB', 'EMBEDDING_MODEL_FILE', fallback=''))
+    BATCH_SIZE: int = _env('BATCH_SIZE', config.getint('VectorDB', 'BATCH_SIZE', fallback=32))
+    CHUNK_TOKENS: int = _env('CHUNK_TOKENS', config.getint('VectorDB', 'CHUNK_TOKENS', fallback=256))
+    CHUNK_OVERLAP_TOKENS: int = _env('CHUNK_OVERLAP_TOKENS', config.getint('VectorDB', 'CHUNK_OVERLAP_TOKENS', fallback=32))
+    EMBED_CACHE_PATH: Path = _env('EMBED_CACHE_PATH', Path(config.get('VectorDB', 'EMBED_CACHE_PATH', fallback='chroma_db/embedding_cache.sqlite')))
+
+    # Semantic query cache
+    SEMANTIC_CACHE_PATH: Path = _env('SEMANTIC_CACHE_PATH', Path(config.get('Cache', 'SEMANTIC_CACHE_PATH', fallback='chroma_db/semantic_cache')))
+    SEMANTIC_CACHE_THRESHOLD: float = _env('SEMANTIC_CACHE_THRESHOLD', config.getfloat('Cache', 'SIMILARITY_THRESHOLD', fallback=0.95))
+    SEMANTIC_CACHE_MAX_ENTRIES: int = _env('SEMANTIC_CACHE_MAX_ENTRIES', config.getint('Cache', 'MAX_ENTRIES', fallback=1000))
+    QUERY_CACHE_MAX_ENTRIES: int = _env('QUERY_CACHE_MAX_ENTRIES', config.getint('Cache', 'QUERY_CACHE_MAX_ENTRIES', fallback=4096))
+    FAQ_PATH: str = _env('FAQ_PATH', config.get('Cache', 'FAQ_PATH', fallback=''))
     
     # Legacy support
     CHROMA_DB_DIR: str = os.getenv("CHROMA_DB_DIR", str(CHROMA_DB_PATH))
-    
-    class Config:
-        env_file = ".env"
-        extra = "allow"  # Allow extra fields from environment variables
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -0,0 +1,75 @@
+"""
+manifest.py
+
+This module keeps a content-addressed manifest of ingested documents in SQLite,
+so a file whose SHA-256 hash has already been ingested under the same filename is
+not extracted, chunked or embedded again. The filename is part of the key because
+it is stored as each chunk's source: the same content uploaded under a new name
+is ingested again so that name can be searched.
+
+The manifest lives inside the Chroma directory, so clearing the vector store also
+clears the record of what it contains.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+from contextlib import closing, contextmanager
+from typing import List, Dict, Any, Optional, Iterator
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.path.join(str(settings.CHROMA_DB_PATH), "manifest.sqlite")
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """Open a connection that commits (or rolls back) and is closed when the block ends."""
+    with closing(sqlite3.connect(MANIFEST_PATH, timeout=10)) as conn, conn:
+        conn.row_factory = sqlite3.Row
+        yield conn
+
+def initialize_manifest() -> None:
+    """Create the manifest table, using WAL so concurrent uploads don't block each other."""
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested_files ("
+            "hash TEXT NOT NULL, filename TEXT NOT NULL, chunks INTEGER NOT NULL, chroma_ids TEXT NOT NULL, "
+            "PRIMARY KEY (hash, filename))"
+        )
+
+def get_document(file_hash: str, filename: str) -> Optional[Dict[str, Any]]:
+    """Return the manifest entry for a file already ingested under this name, if any."""
+    try:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT hash, filename, chunks, chroma_ids FROM ingested_files WHERE hash = ? AND filename = ?",
+                (file_hash, filename)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "hash": row["hash"],
+            "filename": row["filename"],
+            "chunks": row["chunks"],
+            "chroma_ids": json.loads(row["chroma_ids"])
+        }
+    except Exception as e:
+        logger.error(f"Error reading manifest for {filename} ({file_hash}): {str(e)}")
+        return None
+
+def record_document(file_hash: str, filename: str, chroma_ids: List[str]) -> None:
+    """Record that a file has been ingested under this name as the given Chroma chunks."""
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingested_files (hash, filename, chunks, chroma_ids) VALUES (?, ?, ?, ?)",
+                (file_hash, filename, len(chroma_ids), json.dumps(chroma_ids))
+            )
+    except Exception as e:
+        logger.error(f"Error recording {filename} ({file_hash}) in manifest: {str(e)}")
+
+initialize_manifest()
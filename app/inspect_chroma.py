@@ -1,6 +1,7 @@
 from chromadb import PersistentClient
 
-# Connect to your Chroma DB using absolute path
+# Connect to your Chroma DB using absolute path; a bare client doesn't load the
+# embedding model or touch the collection settings, so inspecting is read-only
 import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
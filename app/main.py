@@ -1,9 +1,48 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from .api.routes.upload import upload_router
+from .api.routes.upload import upload_router, OCR_POOL
 from .api.routes.query import query_router
 from .api.routes.theme import theme_router
+from .services.semantic_cache import semantic_cache
+from .services.vector_store import (
+    get_embedder, warm_vector_store, refresh_sidecar_index, ENCODE_POOL, INGEST_POOL, SIDECAR_POOL
+)
+from .services.faiss_index import save_sidecar_index
+from .services.query_batcher import query_batcher
+from .services.synthesis import load_context_tokenizer
+from .core.config import settings
+
+# Default to INFO so debug logging on the request paths costs nothing
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model and run one encode before accepting requests
+    get_embedder().encode(["warmup"])
+    loop = asyncio.get_running_loop()
+    # Load the HNSW index now instead of on the first question
+    await loop.run_in_executor(None, warm_vector_store)
+    # Load or build the FAISS sidecar without delaying startup
+    loop.run_in_executor(SIDECAR_POOL, refresh_sidecar_index)
+    # Precompute embeddings for frequently asked questions
+    loop.run_in_executor(None, query_batcher.warm_from_file, settings.FAQ_PATH)
+    # Fetch the completion model's tokenizer for exact context packing
+    loop.run_in_executor(None, load_context_tokenizer)
+    yield
+    semantic_cache.save()
+    OCR_POOL.shutdown()
+    INGEST_POOL.shutdown()
+    SIDECAR_POOL.shutdown()
+    # Keep chunks added since the last build, so the next start doesn't rebuild
+    save_sidecar_index()
+    ENCODE_POOL.shutdown()
 
-app = FastAPI(title="Document Chatbot")
+app = FastAPI(title="Document Chatbot", lifespan=lifespan)
 from fastapi.middleware.cors import CORSMiddleware
 
 app.add_middleware(
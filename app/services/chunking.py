@@ -0,0 +1,78 @@
+"""
+chunking.py
+
+This module splits extracted document text into overlapping token windows sized for the embedding model.
+"""
+
+import logging
+from typing import List, Dict, Any
+from app.core.config import settings
+from .vector_store import get_embedder
+
+logger = logging.getLogger(__name__)
+
+def chunk_text(
+    text: str,
+    source: str,
+    chunk_tokens: int = settings.CHUNK_TOKENS,
+    overlap: int = settings.CHUNK_OVERLAP_TOKENS
+) -> List[Dict[str, Any]]:
+    """
+    Splits text into sliding windows of at most `chunk_tokens` embedding-model tokens,
+    each overlapping the previous one by `overlap` tokens.
+    Windows are cut from the original text using the tokenizer's character offsets,
+    so chunks keep their original casing and spacing.
+
+    Args:
+        text (str): Extracted document text
+        source (str): Name of the source document, stored in each chunk's metadata
+        chunk_tokens (int): Maximum tokens per chunk
+        overlap (int): Tokens shared between consecutive chunks
+
+    Returns:
+        List[Dict[str, Any]]: Chunks with 'content' and 'meta'
+    """
+    try:
+        embedder = get_embedder()
+        # Leave room for the special tokens the embedder adds, so no chunk gets truncated
+        window = max(1, min(chunk_tokens, embedder.max_seq_length - 2))
+        step = max(1, window - overlap)
+
+        encoding = embedder.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False
+        )
+        offsets = encoding["offset_mapping"]
+        total_tokens = len(offsets)
+
+        chunks = []
+        for start in range(0, total_tokens, step):
+            end = min(start + window, total_tokens)
+            content = text[offsets[start][0]:offsets[end - 1][1]].strip()
+            if content:
+                chunks.append({
+                    "content": content,
+                    "meta": {
+                        "source": source,
+                        "chunk_index": len(chunks),
+                        "start_token": start,
+                        "total_chunks": None  # Set below
+                    }
+                })
+            if end == total_tokens:
+                break
+
+        # Set total_chunks meta
+        for c in chunks:
+            c["meta"]["total_chunks"] = len(chunks)
+        # Log only summary info, not content
+        if chunks:
+            logger.info(f"Chunked {source}: {len(chunks)} chunks from {total_tokens} tokens.")
+        else:
+            logger.info(f"Chunked {source}: No chunks created.")
+        return chunks
+    except Exception as e:
+        logger.error(f"Error chunking text from {source}: {str(e)}")
+        raise ValueError(f"Failed to chunk text: {str(e)}")
@@ -0,0 +1,129 @@
+"""
+embedding_cache.py
+
+This module caches chunk embeddings by the SHA-256 hash of the embedding model name
+and their text, so text that has already been embedded (a re-uploaded or lightly
+edited document, a repeated question) is not encoded again.
+
+Vectors are persisted as float32 blobs in SQLite next to the vector store, with the
+most recently used ones also kept in an in-process LRU.
+"""
+
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, List, Iterator
+import numpy as np
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMBED_CACHE_PATH = str(settings.EMBED_CACHE_PATH)
+MEMORY_CACHE_SIZE = 10000
+
+_memory: "OrderedDict[bytes, List[float]]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """Open a connection that commits (or rolls back) and is closed when the block ends."""
+    with closing(sqlite3.connect(EMBED_CACHE_PATH, timeout=10)) as conn, conn:
+        yield conn
+
+def initialize_embedding_cache() -> None:
+    """Create the cache table, using WAL so readers don't block the ingest writer."""
+    os.makedirs(os.path.dirname(EMBED_CACHE_PATH) or ".", exist_ok=True)
+    with _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+
+# The model (and how it is run) is part of the key, so switching it never serves stale vectors
+MODEL_KEY = ":".join([settings.EMBEDDING_MODEL, settings.EMBEDDING_BACKEND, settings.EMBEDDING_MODEL_FILE])
+
+def _key(text: str) -> bytes:
+    return hashlib.sha256(f"{MODEL_KEY}\0{text}".encode("utf-8")).digest()
+
+def _remember(key: bytes, vector: List[float]) -> None:
+    with _memory_lock:
+        _memory[key] = vector
+        _memory.move_to_end(key)
+        if len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+def _lookup(keys: List[bytes]) -> Dict[bytes, List[float]]:
+    found: Dict[bytes, List[float]] = {}
+    with _memory_lock:
+        for key in keys:
+            if key in _memory:
+                _memory.move_to_end(key)
+                found[key] = _memory[key]
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        try:
+            with _connect() as conn:
+                # Stay well below SQLite's bound-parameter limit
+                for start in range(0, len(missing), 500):
+                    window = missing[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(window))})",
+                        window
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                        found[key] = vector
+                        _remember(key, vector)
+        except Exception as e:
+            logger.error(f"Error reading embedding cache: {str(e)}")
+    return found
+
+def _store(keys: List[bytes], vectors: np.ndarray) -> Dict[bytes, List[float]]:
+    # Blobs come straight from the float32 rows; each vector becomes a list only once
+    entries = dict(zip(keys, vectors.tolist()))
+    for key, vector in entries.items():
+        _remember(key, vector)
+    try:
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, row.tobytes()) for key, row in zip(keys, vectors)]
+            )
+    except Exception as e:
+        logger.error(f"Error writing embedding cache: {str(e)}")
+    return entries
+
+def get_cached_embeddings(
+    texts: List[str],
+    encode: Callable[[List[str]], np.ndarray]
+) -> List[List[float]]:
+    """
+    Return an embedding per text, calling encode only for texts that are not cached yet.
+
+    Args:
+        texts (List[str]): Texts to embed
+        encode (Callable): Encodes a list of texts into a matrix with one row per text
+
+    Returns:
+        List[List[float]]: Embeddings in the same order as texts
+    """
+    keys = [_key(text) for text in texts]
+    found = _lookup(list(dict.fromkeys(keys)))
+
+    # Encode each distinct uncached text once, even if it appears several times
+    misses: Dict[bytes, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in misses:
+            misses[key] = text
+    if misses:
+        vectors = np.asarray(encode(list(misses.values())), dtype=np.float32)
+        found.update(_store(list(misses), vectors))
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Embedding cache: %d hits, %d misses", len(texts) - len(misses), len(misses))
+    return [found[key] for key in keys]
+
+initialize_embedding_cache()
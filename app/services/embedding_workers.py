@@ -0,0 +1,25 @@
+"""
+embedding_workers.py
+
+This module holds the model class that multi-process embedding pools are started from.
+It imports nothing from the app, so the spawned workers can unpickle their copy of the
+model without loading the vector store or its caches.
+"""
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+class PoolModel(SentenceTransformer):
+    """
+    A SentenceTransformer for start_multi_process_pool. When worker_threads is set, each
+    worker's copy limits torch to that many intra-op threads as it is unpickled, before
+    any model code runs there.
+    """
+
+    worker_threads = None
+
+    def __setstate__(self, state):
+        threads = state.get("worker_threads")
+        if threads:
+            torch.set_num_threads(threads)
+        super().__setstate__(state)
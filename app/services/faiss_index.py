@@ -0,0 +1,332 @@
+"""
+faiss_index.py
+
+This module maintains an optional FAISS sidecar index for the ChromaDB collection.
+The sidecar holds the same vectors, quantized to int8, in an in-memory HNSW index,
+plus the chunk documents and metadata, so unfiltered queries can be answered without
+going through ChromaDB's SQLite layer. Large corpora use a compressed IVF-PQ index instead, which
+is served from the GPUs when FAISS was built with GPU support.
+
+ChromaDB stays the source of truth: newly stored chunks are added to the loaded sidecar,
+it is rebuilt from ChromaDB only when none is loaded or it has outgrown the index it was
+trained for, and callers fall back to ChromaDB whenever FAISS is not installed or the
+sidecar is not usable.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+import numpy as np
+from app.core.config import settings
+
+try:
+    import faiss
+except ImportError:  # FAISS is optional
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_PATH = os.path.join(str(settings.CHROMA_DB_PATH), "sidecar.faiss")
+SIDECAR_PAYLOAD_PATH = SIDECAR_PATH + ".json"
+HNSW_M = 32
+BUILD_PAGE_SIZE = 5000
+# Above this many vectors the sidecar trades HNSW for a trained, compressed IVF-PQ index
+IVFPQ_MIN_VECTORS = 200000
+PQ_SUBQUANTIZERS = 64
+IVF_NPROBE = 32
+# Once chunks added since the last build have grown the index by this factor, it is
+# rebuilt so its quantizers are trained on the current corpus
+REBUILD_GROWTH = 2.0
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+# Adds are applied one at a time; unfiltered searches use ChromaDB while one runs
+_add_lock = threading.Lock()
+_no_readers = threading.Condition(_lock)
+_readers = 0
+_adding = False
+# FAISS GPU indexes are not thread-safe, so searches on them are serialized
+_gpu_lock = threading.Lock()
+_index = None
+_payload: Optional[Dict[str, List[Any]]] = None
+_on_gpu = False
+_built_count = 0
+_saved_count = 0
+# Bumped by every invalidation, so an index read from an older state of the collection is never installed
+_generation = 0
+# Chunks stored while a build runs, added to the new index before it is installed
+_building = False
+_pending_adds: List[tuple] = []
+
+def is_available() -> bool:
+    """Whether FAISS is installed."""
+    return faiss is not None
+
+def _normalized(vectors: Any) -> np.ndarray:
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(matrix)
+    return matrix
+
+def _new_index(vectors: np.ndarray):
+    count, dim = vectors.shape
+    # Cosine similarity is the inner product of normalized vectors
+    if count < IVFPQ_MIN_VECTORS or dim % PQ_SUBQUANTIZERS:
+        # int8 scalar quantization stores each vector in a quarter of the float32 size
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        return index
+    nlist = min(4096, int(4 * np.sqrt(count)))
+    index = faiss.index_factory(dim, f"IVF{nlist},PQ{PQ_SUBQUANTIZERS}", faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    return index
+
+def _for_search(index):
+    """
+    Set the IVF probe depth and move IVF indexes to the GPUs, if there are any.
+
+    Returns:
+        Tuple: The index to search and whether it is on the GPUs
+    """
+    if not isinstance(index, faiss.IndexIVF):
+        return index, False
+    index.nprobe = IVF_NPROBE
+    if faiss.get_num_gpus() > 0:
+        try:
+            # float16 lookup tables keep PQ64 within the GPUs' shared memory
+            options = faiss.GpuMultipleClonerOptions()
+            options.useFloat16 = True
+            return faiss.index_cpu_to_all_gpus(index, co=options), True
+        except Exception as e:
+            logger.warning(f"Could not move FAISS sidecar index to GPU, searching on CPU: {str(e)}")
+    return index, False
+
+def _extend(index, payload: Dict[str, List[Any]], ids: List[str], vectors: np.ndarray, documents: List[str], metadatas: List[Any]) -> None:
+    index.add(vectors)
+    payload["ids"].extend(ids)
+    payload["documents"].extend(documents)
+    payload["metadatas"].extend(metadatas)
+
+def _write(index, payload: Dict[str, List[Any]]) -> None:
+    # Write to temporary files first so readers never see a half-written sidecar
+    faiss.write_index(index, SIDECAR_PATH + ".tmp")
+    with open(SIDECAR_PAYLOAD_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(SIDECAR_PATH + ".tmp", SIDECAR_PATH)
+    os.replace(SIDECAR_PAYLOAD_PATH + ".tmp", SIDECAR_PAYLOAD_PATH)
+
+def build_sidecar_index(collection) -> bool:
+    """
+    Rebuild the sidecar from every vector in the collection and swap it in.
+    Chunks added while it is being built are added to the new index before the swap.
+
+    Returns:
+        bool: True if a sidecar was built
+    """
+    global _index, _payload, _on_gpu, _built_count, _saved_count, _building
+    if faiss is None:
+        return False
+    with _build_lock:
+        with _lock:
+            generation = _generation
+            _building = True
+            _pending_adds.clear()
+        try:
+            count = collection.count()
+            if not count:
+                return False
+
+            # Page through the collection so only one page of embeddings exists as Python
+            # floats at a time; the rest is packed into a float32 matrix as it arrives
+            vectors = None
+            payload = {"ids": [], "documents": [], "metadatas": []}
+            for offset in range(0, count, BUILD_PAGE_SIZE):
+                page = collection.get(
+                    include=["embeddings", "documents", "metadatas"], limit=BUILD_PAGE_SIZE, offset=offset
+                )
+                # Chunks stored after count() was read are added from _pending_adds below
+                take = min(len(page["ids"]), count - offset)
+                if not take:
+                    break
+                rows = np.asarray(page["embeddings"][:take], dtype=np.float32)
+                if vectors is None:
+                    vectors = np.empty((count, rows.shape[1]), dtype=np.float32)
+                vectors[offset:offset + take] = rows
+                for key in payload:
+                    payload[key].extend(page[key][:take])
+            vectors = _normalized(vectors[:len(payload["ids"])])
+
+            index = _new_index(vectors)
+            index.add(vectors)
+            _write(index, payload)
+            built_count = index.ntotal
+
+            search_index, on_gpu = _for_search(index)
+            known = set(payload["ids"])
+            while True:
+                with _lock:
+                    # The sidecar was invalidated since this build read the collection;
+                    # the rebuild requested after that reads it again
+                    if _generation != generation:
+                        logger.info("Collection changed while building the FAISS sidecar index; not installing it")
+                        return False
+                    if not _pending_adds:
+                        _index, _payload, _on_gpu = search_index, payload, on_gpu
+                        _built_count = _saved_count = built_count
+                        break
+                    pending = list(_pending_adds)
+                    _pending_adds.clear()
+                for ids, added, documents, metadatas in pending:
+                    # The build may already have read some of them from the collection
+                    keep = [i for i, id_ in enumerate(ids) if id_ not in known]
+                    if keep:
+                        _extend(
+                            search_index, payload, [ids[i] for i in keep], added[keep],
+                            [documents[i] for i in keep], [metadatas[i] for i in keep]
+                        )
+                        known.update(ids[i] for i in keep)
+            logger.info(f"Built FAISS sidecar index with {search_index.ntotal} vectors")
+            return True
+        except Exception as e:
+            logger.error(f"Error building FAISS sidecar index: {str(e)}")
+            return False
+        finally:
+            with _lock:
+                _building = False
+                _pending_adds.clear()
+
+def load_sidecar_index(expected_count: int) -> bool:
+    """
+    Read a previously built sidecar into memory if it matches the collection size.
+
+    Returns:
+        bool: True if a fresh sidecar is loaded
+    """
+    global _index, _payload, _on_gpu, _built_count, _saved_count
+    if faiss is None or not os.path.exists(SIDECAR_PATH) or not os.path.exists(SIDECAR_PAYLOAD_PATH):
+        return False
+    with _lock:
+        generation = _generation
+    try:
+        # Loaded into memory rather than mapped, so newly stored chunks can be added to it
+        index = faiss.read_index(SIDECAR_PATH)
+        if index.ntotal != expected_count:
+            logger.info("FAISS sidecar index is stale")
+            return False
+        with open(SIDECAR_PAYLOAD_PATH, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        search_index, on_gpu = _for_search(index)
+        with _lock:
+            if _generation != generation:
+                logger.info("FAISS sidecar index is stale")
+                return False
+            _index, _payload, _on_gpu = search_index, payload, on_gpu
+            _built_count = _saved_count = index.ntotal
+        logger.info(f"Loaded FAISS sidecar index with {index.ntotal} vectors")
+        return True
+    except Exception as e:
+        logger.error(f"Error loading FAISS sidecar index: {str(e)}")
+        return False
+
+def add_to_sidecar_index(
+    ids: List[str],
+    embeddings: List[List[float]],
+    documents: List[str],
+    metadatas: List[Any]
+) -> bool:
+    """
+    Add newly stored chunks to the loaded sidecar, or to the one being built.
+
+    Returns:
+        bool: False if the sidecar should be rebuilt, because none is loaded or
+        it has outgrown the index it was trained for
+    """
+    global _generation, _adding
+    if faiss is None or not ids:
+        return True
+    vectors = _normalized(embeddings)
+    with _add_lock:
+        with _lock:
+            if _building:
+                _pending_adds.append((ids, vectors, documents, metadatas))
+            index, payload = _index, _payload
+            if index is None:
+                if not _building:
+                    # A sidecar still being loaded can't contain these chunks
+                    _generation += 1
+                return _building
+            _adding = True
+            _no_readers.wait_for(lambda: _readers == 0)
+        try:
+            _extend(index, payload, ids, vectors, documents, metadatas)
+        except Exception as e:
+            logger.error(f"Error adding to FAISS sidecar index: {str(e)}")
+            invalidate_sidecar_index()
+            return False
+        finally:
+            with _lock:
+                _adding = False
+    total = index.ntotal
+    return total < REBUILD_GROWTH * _built_count and not (_built_count < IVFPQ_MIN_VECTORS <= total)
+
+def save_sidecar_index() -> None:
+    """Write the loaded sidecar if chunks were added since it was written, so the next start loads it instead of rebuilding."""
+    global _saved_count
+    if faiss is None:
+        return
+    with _add_lock:
+        with _lock:
+            index, payload, on_gpu = _index, _payload, _on_gpu
+        if index is None or index.ntotal == _saved_count:
+            return
+        try:
+            _write(faiss.index_gpu_to_cpu(index) if on_gpu else index, payload)
+            _saved_count = index.ntotal
+            logger.info(f"Saved FAISS sidecar index with {index.ntotal} vectors")
+        except Exception as e:
+            logger.error(f"Error saving FAISS sidecar index: {str(e)}")
+
+def invalidate_sidecar_index() -> None:
+    """Stop serving from the sidecar until it is rebuilt, e.g. after chunks are removed."""
+    global _index, _payload, _on_gpu, _generation
+    with _lock:
+        _index, _payload, _on_gpu = None, None, False
+        _generation += 1
+
+def search_sidecar_index(query_embedding: List[float], n_results: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Query the sidecar index.
+
+    Returns:
+        Optional[List[Dict]]: Results shaped like ChromaDB's formatted results,
+        or None if no fresh sidecar is loaded or chunks are being added to it
+    """
+    global _readers
+    with _lock:
+        if _index is None or _payload is None or _adding:
+            return None
+        index, payload, on_gpu = _index, _payload, _on_gpu
+        _readers += 1
+    try:
+        query = _normalized([query_embedding])
+        k = min(n_results, index.ntotal)
+        if on_gpu:
+            with _gpu_lock:
+                scores, positions = index.search(query, k)
+        else:
+            scores, positions = index.search(query, k)
+        return [
+            {
+                "content": payload["documents"][position],
+                "metadata": payload["metadatas"][position] or {},
+                "similarity": float(score)
+            }
+            for score, position in zip(scores[0], positions[0])
+            if position != -1
+        ]
+    finally:
+        with _lock:
+            _readers -= 1
+            if not _readers:
+                _no_readers.notify_all()
@@ -3,17 +3,13 @@ import sys
 import platform
 import pytesseract
 from pdf2image.pdf2image import convert_from_bytes, convert_from_path
-from PyPDF2 import PdfReader
+import pypdfium2 as pdfium
 from typing import List, Union
 import logging
 from pathlib import Path
 import re
-
-# Configure logging with proper format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -86,6 +82,33 @@ if POPPLER_PATH:
 else:
     logger.warning("Poppler path not configured. PDF to image conversion will not work.")
 
+# Files are extracted in OCR_PROCESSES worker processes, and each OCRs the pages of a
+# scanned PDF in parallel with OCR_WORKERS single-threaded Tesseract processes, so even
+# with every worker busy there are at most about one Tesseract process per core.
+OCR_PROCESSES = max(1, (os.cpu_count() or 1) // 4)
+OCR_WORKERS = max(1, (os.cpu_count() or 1) // OCR_PROCESSES)
+# PDFs with less selectable text than this per page are treated as scanned
+MIN_CHARS_PER_PAGE = 20
+
+# Niceness of extraction workers and their Tesseract processes, so OCR bursts take
+# the cores the query encoders leave idle instead of competing with them
+OCR_NICENESS = 10
+
+def init_ocr_worker() -> None:
+    """
+    Initializer for text-extraction worker processes. Limits each Tesseract subprocess
+    they start to one thread so parallel pages don't oversubscribe the cores; set here
+    rather than at import so the API server's own OpenMP/torch threads are unaffected.
+    The workers and their subprocesses also run at a lower priority than the server.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    if hasattr(os, "nice"):  # Not available on Windows
+        os.nice(OCR_NICENESS)
+
+def _ocr_page(image_path: str) -> str:
+    """OCR a single rendered page image."""
+    return pytesseract.image_to_string(image_path)
+
 def extract_text_from_file(file_path: str) -> Union[str, List[dict]]:
     """
     Extracts text from a file on disk (PDF, image, or text).
@@ -108,35 +131,53 @@ def extract_text_from_file(file_path: str) -> Union[str, List[dict]]:
         if filename.endswith(".pdf"):
             try:
                 # First try to extract text directly from PDF
-                with open(file_path, 'rb') as file:
-                    reader = PdfReader(file)
-                    text = ""
-                    total_pages = len(reader.pages)
-                    
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    total_pages = len(pdf)
                     logger.info(f"Processing PDF: {filename} with {total_pages} pages")
-                    
-                    for page_num, page in enumerate(reader.pages, 1):
-                        logger.info(f"Processing page {page_num}/{total_pages}")
-                        page_text = page.extract_text() or ""
-                        text += page_text + "\n"
-
-                    if not text.strip():  # fallback to OCR if no text found
-                        logger.info(f"No text found in PDF {filename}, falling back to OCR")
-                        try:
-                            # Use poppler path on Windows
-                            if platform.system() == "Windows" and POPPLER_PATH and os.path.exists(POPPLER_PATH):
-                                logger.info(f"Converting PDF to images using Poppler at {POPPLER_PATH}")
-                                images = convert_from_path(file_path, poppler_path=POPPLER_PATH)
-                                # Process each page
-                                for i, image in enumerate(images, start=1):
-                                    page_text = pytesseract.image_to_string(image)
-                                    text += f"\n--- Page {i} ---\n{page_text}"
-                            else:
-                                logger.warning("Skipping OCR for PDF - Poppler not configured correctly")
-                        except Exception as ocr_error:
-                            logger.error(f"OCR failed for PDF {filename}: {str(ocr_error)}")
-                            return f"PDF OCR failed: {str(ocr_error)}"
-                    return text.strip()
+                    page_texts = []
+                    for page_index in range(total_pages):
+                        page = pdf[page_index]
+                        textpage = page.get_textpage()
+                        page_texts.append(textpage.get_text_range())
+                        textpage.close()
+                        page.close()
+                finally:
+                    pdf.close()
+                text = "\n".join(page_texts)
+
+                # Fall back to OCR when the PDF has (almost) no selectable text
+                if len(text.strip()) < MIN_CHARS_PER_PAGE * total_pages:
+                    logger.info(f"No text found in PDF {filename}, falling back to OCR")
+                    try:
+                        # Use poppler path on Windows
+                        if platform.system() == "Windows" and POPPLER_PATH and os.path.exists(POPPLER_PATH):
+                            logger.info(f"Converting PDF to images using Poppler at {POPPLER_PATH}")
+                            with tempfile.TemporaryDirectory() as image_dir:
+                                # Render pages straight to disk with several pdftocairo threads
+                                page_paths = convert_from_path(
+                                    file_path,
+                                    poppler_path=POPPLER_PATH,
+                                    dpi=300,
+                                    fmt="png",
+                                    thread_count=OCR_WORKERS,
+                                    output_folder=image_dir,
+                                    paths_only=True
+                                )
+                                # pytesseract runs Tesseract as a subprocess, so threads are enough to use every core
+                                with ThreadPoolExecutor(max_workers=OCR_WORKERS) as executor:
+                                    ocr_texts = list(executor.map(_ocr_page, page_paths))
+                            # OCR output replaces the sparse selectable text
+                            text = "".join(
+                                f"\n--- Page {i} ---\n{page_text}"
+                                for i, page_text in enumerate(ocr_texts, start=1)
+                            )
+                        else:
+                            logger.warning("Skipping OCR for PDF - Poppler not configured correctly")
+                    except Exception as ocr_error:
+                        logger.error(f"OCR failed for PDF {filename}: {str(ocr_error)}")
+                        return f"PDF OCR failed: {str(ocr_error)}"
+                return text.strip()
 
             except Exception as pdf_error:
                 logger.error(f"PDF processing failed for {filename}: {str(pdf_error)}")
@@ -192,17 +233,3 @@ def extract_text_from_file(file_path: str) -> Union[str, List[dict]]:
     except Exception as e:
         logger.error(f"Extraction failed for {file_path}: {str(e)}")
         return f"Text extraction failed: {str(e)}"
-
-def chunk_text(text: str, max_tokens: int = 800) -> List[dict]:
-    """
-    Splits a large block of text into smaller paragraph-based chunks.
-    Converts every new line in a paragraph to a bullet point for cleaner downstream responses.
-    """
-    paragraphs = text.split("\n\n")
-    cleaned_chunks = []
-    for p in paragraphs:
-        # Replace all newlines with bullet points
-        bulletified = '\n'.join([f'- {line.strip()}' for line in p.strip().split('\n') if line.strip()])
-        if bulletified:
-            cleaned_chunks.append({"content": bulletified, "meta": {"source": "upload"}})
-    return cleaned_chunks
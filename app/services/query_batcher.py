@@ -0,0 +1,133 @@
+"""
+query_batcher.py
+
+This module coalesces query embeddings from concurrent requests. Queries that
+arrive within a few milliseconds of each other are encoded in a single model
+call instead of one call per request, and recently asked (or preloaded FAQ)
+questions are answered from an in-process LRU without running the model at all.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+from .semantic_cache import semantic_cache
+from .vector_store import ENCODE_POOL, get_embedder
+from .embedding_cache import get_cached_embeddings
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def _model_is_uncased() -> bool:
+    """Whether the embedding model's tokenizer lowercases its input, as the default model's does."""
+    return bool(getattr(get_embedder().tokenizer, "do_lower_case", False))
+
+def normalize_query(text: str) -> str:
+    """Whitespace-insensitive cache key, also case-insensitive when the embedding model is uncased."""
+    text = " ".join(text.split())
+    return text.lower() if _model_is_uncased() else text
+
+class QueryBatcher:
+    """
+    Collects texts passed to encode() and runs encode_batch over them together,
+    once max_batch texts are waiting or max_wait seconds after the first one arrived.
+    The last cache_size embeddings are kept by normalized text.
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[List[str]], np.ndarray],
+        max_batch: int = 32,
+        max_wait: float = 0.005,
+        cache_size: int = 4096
+    ):
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Embed one text, sharing the model call with any concurrent callers."""
+        key = normalize_query(text)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        vector = await future
+        self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def warm(self, texts: List[str]) -> None:
+        """
+        Preload embeddings for expected questions. They go through the persistent
+        embedding cache, so after the first start they are read rather than encoded.
+        """
+        texts = [text for text in texts if normalize_query(text)]
+        if not texts:
+            return
+        vectors = get_cached_embeddings(texts, self.encode_batch)
+        for text, vector in zip(texts, vectors):
+            self._remember(normalize_query(text), np.asarray(vector, dtype=np.float32))
+        logger.info(f"Warmed query embedding cache with {len(texts)} questions")
+
+    def warm_from_file(self, path: str) -> None:
+        """Preload one question per line from a text file; lines starting with # are skipped."""
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.warm([line.strip() for line in f if not line.lstrip().startswith("#")])
+        except Exception as e:
+            logger.error(f"Error warming query embedding cache from {path}: {str(e)}")
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            # The encoder is CPU/GPU bound, so keep it off the event loop
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                ENCODE_POOL, self.encode_batch, [text for text, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"Error encoding query batch: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        logger.debug("Encoded %d queries in one batch", len(batch))
+        for (_, future), vector in zip(batch, vectors):
+            # The caller may have disconnected in the meantime
+            if not future.done():
+                future.set_result(vector)
+
+query_batcher = QueryBatcher(semantic_cache.encode_batch, cache_size=settings.QUERY_CACHE_MAX_ENTRIES)
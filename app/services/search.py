@@ -10,48 +10,51 @@ from .vector_store import query_similar_chunks
 
 logger = logging.getLogger(__name__)
 
-def search_similar(query: str, source: Optional[str] = None, n_results: int = 10) -> List[Dict[str, Any]] | Dict[str, str]:
+def search_similar(
+    query: str,
+    source: Optional[str] = None,
+    n_results: int = 10,
+    query_embedding: Optional[List[float]] = None
+) -> List[Dict[str, Any]] | Dict[str, str]:
     """
     Search for similar content in the vector store.
     
     Args:
         query (str): The search query
-        source (Optional[str]): Optional source file to filter results
+        source (Optional[str]): Optional source file to filter results, matched case-insensitively
         n_results (int): Number of results to return
+        query_embedding (Optional[List[float]]): Precomputed embedding of the query, if the caller has one
         
     Returns:
         List[Dict[str, Any]]: List of similar chunks with metadata and similarity scores
     """
     try:
-        # Get similar chunks from vector store
-        results = query_similar_chunks(query, n_results=n_results)
-        print("results", results)   
+        # Get similar chunks from vector store, filtering by source inside ChromaDB.
+        # Sources match case-insensitively through the lowercased source_key; chunks
+        # stored before source_key existed only match their exact source.
+        results = query_similar_chunks(
+            query,
+            n_results=n_results,
+            where={"$or": [{"source_key": source.lower()}, {"source": source}]} if source else None,
+            query_embedding=query_embedding
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Vector store returned %d results", len(results))
         
         if not results:
             logger.warning(f"No results found for query: {query}")
             return []
-            
-        # Filter by source if specified
-        if source:
-            results = [
-                r for r in results 
-                if r.get("metadata", {}).get("source", "").lower() == source.lower()
-            ]
-            
-        # Deduplicate by content
-        seen = set()
-        deduped_results = []
+
+        # Deduplicate by content, keeping the first (highest-ranked) copy of each chunk
+        # along with its own metadata and score
+        unique_results: Dict[str, Dict[str, Any]] = {}
         for result in results:
-            content = result.get("content", "")
-            if content not in seen:
-                seen.add(content)
-                deduped_results.append(result)
-        results = deduped_results
+            unique_results.setdefault(result["content"], result)
+        results = list(unique_results.values())
 
         # Format results
-        formatted_results = []
-        for result in results:
-            formatted_result = {
+        return [
+            {
                 "content": result["content"],
                 "meta": {
                     "source": result["metadata"].get("source", "unknown"),
@@ -60,11 +63,9 @@ def search_similar(query: str, source: Optional[str] = None, n_results: int = 10
                     "total_chunks": result["metadata"].get("total_chunks", 1)
                 }
             }
-            formatted_results.append(formatted_result)
-            
-        return formatted_results
+            for result in results
+        ]
         
     except Exception as e:
         logger.error(f"Error in search_similar: {str(e)}")
-        print("Error in search_similar:", e)    
         return {"status": "error", "message": str(e)}
@@ -0,0 +1,141 @@
+"""
+semantic_cache.py
+
+This module caches answers to previous queries keyed by their sentence embeddings.
+A new query whose embedding is close enough to a cached one is answered from the cache,
+skipping both the vector search and the LLM completion.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+import numpy as np
+import torch
+from app.core.config import settings
+from .vector_store import get_embedder
+from .embedding_cache import MODEL_KEY
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    In-process cache of (query embedding -> answer) pairs.
+
+    Embeddings are kept L2-normalized in a single matrix so a lookup is one
+    matrix-vector product. When full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.95, max_entries: int = 1000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._embeddings: Optional[np.ndarray] = None
+        self._entries: List[Dict[str, Any]] = []
+
+    def encode(self, query: str) -> np.ndarray:
+        """Embed a query the same way cached queries were embedded."""
+        return self.encode_batch([query])[0]
+
+    def encode_batch(self, queries: List[str]) -> np.ndarray:
+        """Embed several queries in one model call, one row per query."""
+        with torch.inference_mode():
+            embeddings = get_embedder().encode(queries, normalize_embeddings=True, convert_to_numpy=True)
+        return embeddings.astype(np.float32)
+
+    def lookup(self, query_embedding: np.ndarray, source: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached answer for the most similar previous query, if it is
+        similar enough and was asked against the same source.
+        """
+        with self._lock:
+            if self._embeddings is None or not self._entries:
+                return None
+
+            sims = self._embeddings @ query_embedding
+            mismatched = [i for i, entry in enumerate(self._entries) if entry["source"] != source]
+            sims[mismatched] = -1.0
+
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+
+            entry = self._entries[best]
+            entry["last_used"] = time.time()
+            logger.info(f"Semantic cache hit (similarity {sims[best]:.3f})")
+            return {"answer": entry["answer"], "sources": entry["sources"]}
+
+    def add(self, query_embedding: np.ndarray, answer: str, sources: Any, source: Optional[str] = None) -> None:
+        """Cache an answer, evicting the least recently used entry when full."""
+        with self._lock:
+            if self._embeddings is not None and len(self._entries) >= self.max_entries:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                del self._entries[oldest]
+                self._embeddings = np.delete(self._embeddings, oldest, axis=0)
+
+            row = query_embedding.reshape(1, -1).astype(np.float32)
+            self._embeddings = row if self._embeddings is None else np.vstack([self._embeddings, row])
+            self._entries.append({
+                "answer": answer,
+                "sources": sources,
+                "source": source,
+                "last_used": time.time()
+            })
+
+    def clear(self) -> None:
+        """Drop all cached answers, e.g. after new documents change what the answers would be."""
+        with self._lock:
+            self._embeddings = None
+            self._entries = []
+
+    def save(self) -> None:
+        """Persist the cache next to the vector store."""
+        if not self.path:
+            return
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                if self._embeddings is None:
+                    for ext in (".npy", ".json"):
+                        if os.path.exists(self.path + ext):
+                            os.remove(self.path + ext)
+                    return
+                np.save(self.path + ".npy", self._embeddings)
+                with open(self.path + ".json", "w", encoding="utf-8") as f:
+                    json.dump({"model": MODEL_KEY, "entries": self._entries}, f)
+            logger.info(f"Saved {len(self._entries)} semantic cache entries to {self.path}")
+        except Exception as e:
+            logger.error(f"Error saving semantic cache: {str(e)}")
+
+    def load(self) -> None:
+        """Load a previously persisted cache, if any."""
+        if not self.path or not os.path.exists(self.path + ".npy"):
+            return
+        try:
+            with open(self.path + ".json", "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            # Embeddings from another model (or one run differently) can't be compared with new queries
+            if not isinstance(saved, dict) or saved.get("model") != MODEL_KEY:
+                logger.warning("Semantic cache was saved for a different embedding model, starting with an empty cache")
+                return
+            entries = saved["entries"]
+            embeddings = np.load(self.path + ".npy")
+            if embeddings.ndim != 2 or len(entries) != len(embeddings):
+                logger.warning("Semantic cache files are out of sync, starting with an empty cache")
+                return
+            with self._lock:
+                self._embeddings = embeddings.astype(np.float32)
+                self._entries = entries
+            logger.info(f"Loaded {len(entries)} semantic cache entries from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading semantic cache: {str(e)}")
+
+semantic_cache = SemanticCache(
+    path=str(settings.SEMANTIC_CACHE_PATH),
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES
+)
+semantic_cache.load()
@@ -1,9 +1,18 @@
 import os
 import logging
 import re
-from typing import List, Dict, Union, Any, Optional
+import httpx
+from functools import lru_cache
+import numpy as np
+from typing import List, Dict, Union, Any, Optional, AsyncIterator
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, AsyncGroq
+from app.core.config import settings
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Fall back to the character estimate
+    Tokenizer = None
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -11,19 +20,60 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize GROQ client
-try:
+# Keep TLS connections to Groq open between questions (httpx drops idle ones after 5s by default)
+GROQ_POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120)
+
+@lru_cache(maxsize=1)
+def get_groq_client() -> Groq:
+    """Create the GROQ client on first use; every request then reuses its connection pool."""
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY environment variable is not set")
-    client = Groq(api_key=api_key)
-except Exception as e:
-    logger.error(f"Error initializing GROQ client: {str(e)}")
-    raise
+    return Groq(api_key=api_key, http_client=httpx.Client(limits=GROQ_POOL_LIMITS))
+
+@lru_cache(maxsize=1)
+def get_async_groq_client() -> AsyncGroq:
+    """Async counterpart of get_groq_client, used for streaming."""
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY environment variable is not set")
+    return AsyncGroq(api_key=api_key, http_client=httpx.AsyncClient(limits=GROQ_POOL_LIMITS))
 
 # Type alias for chunk structure
 ChunkType = Dict[str, Any]
 
+# Tokenizer of the completion model, used to pack the context by real token counts.
+# Loaded in the background at startup; until then the 4-chars-per-token estimate is used.
+_context_tokenizer = None
+
+def load_context_tokenizer() -> None:
+    """Load the completion model's tokenizer from the Hugging Face hub (or its local cache)."""
+    global _context_tokenizer
+    if Tokenizer is None or _context_tokenizer is not None:
+        return
+    try:
+        _context_tokenizer = Tokenizer.from_pretrained(settings.CONTEXT_TOKENIZER)
+        logger.info(f"Loaded context tokenizer {settings.CONTEXT_TOKENIZER}")
+    except Exception as e:
+        logger.warning(f"Could not load context tokenizer, estimating tokens from length: {str(e)}")
+
+# Kept byte-identical across requests so the provider can reuse its cached prefix
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Strictly follow these rules:"
+    "1. Only answer the user's question based on the provided context."
+    "2. Do NOT explain your process, logic, or how you answered."
+    "3. Do NOT list all sources, only answer concisely."
+    "4. If information is not in the context, say 'I don't have enough information.'"
+    "5. Use bullet points for lists."
+    "6. Maintain a professional tone."
+)
+
+# Compiled once; format_response and _visible_text run on every answer and stream chunk
+_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+_BULLET_RE = re.compile(r'(?<!\n)•')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
 def format_response(text: str) -> str:
     """
     Format the response text to ensure proper line breaks and readability.
@@ -39,20 +89,122 @@ def format_response(text: str) -> str:
     if not text:
         return text
     # Remove <think>...</think> blocks
-    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    text = _THINK_RE.sub("", text)
     # Split into sentences and clean up
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+    sentences = _SENTENCE_RE.split(text)
     sentences = [s.strip() for s in sentences if s.strip()]
     # Add line breaks between sentences
     formatted = "\n".join(sentences)
     # Ensure bullet points are on new lines
-    formatted = re.sub(r'(?<!\n)•', '\n•', formatted)
+    formatted = _BULLET_RE.sub('\n•', formatted)
     # Add bullet point to each new line if not already present
     formatted = '\n'.join([f'- {line.lstrip("- ")}' if not line.startswith('-') and line else line for line in formatted.split('\n')])
     # Clean up multiple newlines
-    formatted = re.sub(r'\n{3,}', '\n\n', formatted)
+    formatted = _BLANK_LINES_RE.sub('\n\n', formatted)
     return formatted.strip()
 
+def _select_context(results: List[ChunkType], max_tokens: int = 800) -> Dict[str, Any]:
+    """
+    Pick the chunks to send to the LLM using an adaptive similarity threshold,
+    truncating the context to fit within max_tokens.
+
+    Returns:
+        dict: {"context": str, "sources": List[Dict[str, Any]]}, or
+              {"answer": str, "sources": []} when there is nothing usable to send
+    """
+    if not results:
+        return {"answer": "No relevant information found.", "sources": []}
+    # Improved adaptive similarity threshold
+    if len(results) > 10:
+        similarity_threshold = 0.35
+    else:
+        similarity_threshold = 0.2
+    top_n = 10
+    # Filter and rank with one vectorized pass instead of per-element Python comparisons
+    similarities = np.fromiter(
+        (r.get('meta', {}).get('similarity', 0) for r in results), dtype=np.float32, count=len(results)
+    )
+    kept = np.flatnonzero(similarities >= similarity_threshold)
+    if kept.size == 0:
+        return {"answer": "No relevant information found above similarity threshold.", "sources": []}
+    # Stable sort keeps retrieval order among equal scores
+    ranked = kept[np.argsort(-similarities[kept], kind="stable")[:top_n]]
+    sorted_results = [results[i] for i in ranked]
+    # Truncate context to fit within max tokens
+    tokenizer = _context_tokenizer
+    contents = [chunk.get('content', '') for chunk in sorted_results]
+    if tokenizer is not None:
+        token_ids = [encoding.ids for encoding in tokenizer.encode_batch(contents, add_special_tokens=False)]
+    context_parts = []
+    total_tokens = 0
+    for i, content in enumerate(contents):
+        if tokenizer is not None:
+            chunk_tokens = max(len(token_ids[i]), 1)
+        else:
+            # Estimate tokens (roughly 1 token per 4 chars)
+            chunk_tokens = max(len(content) // 4, 1)
+        if total_tokens + chunk_tokens > max_tokens:
+            # Truncate content to fit remaining tokens
+            remaining_tokens = max_tokens - total_tokens
+            if remaining_tokens > 0:
+                if tokenizer is not None:
+                    truncated_content = tokenizer.decode(token_ids[i][:remaining_tokens])
+                else:
+                    truncated_content = content[:remaining_tokens * 4]
+                context_parts.append(truncated_content)
+                total_tokens += remaining_tokens
+            break
+        else:
+            context_parts.append(content)
+            total_tokens += chunk_tokens
+    if not context_parts:
+        return {"answer": "Could not process any of the search results.", "sources": []}
+    # Only include sources for used chunks
+    used_sources = [
+        {"source": chunk.get("meta", {}).get("source", "unknown"), "similarity": chunk.get("meta", {}).get("similarity", 0)}
+        for chunk in sorted_results
+    ]
+    return {"context": "\n\n".join(context_parts), "sources": used_sources}
+
+def _build_messages(query: str, context: str) -> List[Dict[str, str]]:
+    """
+    Build the chat messages for a question and its retrieved context.
+    The context goes before the question so repeated retrievals share a longer cacheable prefix.
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
+    ]
+
+def _completion_params(max_tokens: int) -> Dict[str, Any]:
+    """Sampling parameters shared by the blocking and streaming completions."""
+    return {
+        "model": "qwen/qwen3-32b",  # Using faster model for better response time
+        "temperature": 0.3,
+        "max_tokens": max_tokens,
+        "presence_penalty": 0.3,
+        "frequency_penalty": 0.3,
+        "top_p": 1.0,           # Controls nucleus sampling, 1.0 = use all tokens
+        "n": 1,                 # Number of completions to generate
+        "stop": None            # You can set stop sequences if needed, e.g. ["\n"]
+    }
+
+def _visible_text(text: str) -> str:
+    """
+    Return the part of a partially streamed answer that is safe to show:
+    completed <think>...</think> blocks are removed and anything from an
+    unfinished (or partially received) <think> tag onwards is held back.
+    """
+    text = _THINK_RE.sub("", text)
+    open_at = text.find("<think>")
+    if open_at != -1:
+        text = text[:open_at]
+    for n in range(min(len("<think>") - 1, len(text)), 0, -1):
+        if "<think>".startswith(text[-n:]):
+            text = text[:-n]
+            break
+    return text.lstrip()
+
 def summarize_themes(results: List[ChunkType], query: str, max_tokens: int = 800) -> Dict[str, Any]:
     """
     Synthesize search results into a coherent answer using GPT.
@@ -68,74 +220,15 @@ def summarize_themes(results: List[ChunkType], query: str, max_tokens: int = 800
         dict: {"answer": str, "sources": List[Dict[str, Any]]}
     """
     try:
-        if not results:
-            return {"answer": "No relevant information found.", "sources": []}
-        # Improved adaptive similarity threshold
-        if len(results) > 10:
-            similarity_threshold = 0.35
-        else:
-            similarity_threshold = 0.2
-        top_n = 10
-        filtered_results = [r for r in results if r.get('meta', {}).get('similarity', 0) >= similarity_threshold]
-        if not filtered_results:
-            return {"answer": "No relevant information found above similarity threshold.", "sources": []}
-        sorted_results = sorted(
-            filtered_results,
-            key=lambda x: x.get('meta', {}).get('similarity', 0),
-            reverse=True
-        )
-        # Truncate context to fit within max tokens
-        context_parts = []
-        total_tokens = 0
-        for chunk in sorted_results[:top_n]:
-            content = chunk.get('content', '')
-            # Estimate tokens (roughly 1 token per 4 chars)
-            chunk_tokens = max(len(content) // 4, 1)
-            if total_tokens + chunk_tokens > max_tokens:
-                # Truncate content to fit remaining tokens
-                remaining_tokens = max_tokens - total_tokens
-                if remaining_tokens > 0:
-                    max_chars = remaining_tokens * 4
-                    truncated_content = content[:max_chars]
-                    context_parts.append(truncated_content)
-                    total_tokens += remaining_tokens
-                break
-            else:
-                context_parts.append(content)
-                total_tokens += chunk_tokens
-        if not context_parts:
-            return {"answer": "Could not process any of the search results.", "sources": []}
-        context = "\n\n".join(context_parts)
-        # Only include sources for used chunks
-        used_sources = [
-            {"source": chunk.get("meta", {}).get("source", "unknown"), "similarity": chunk.get("meta", {}).get("similarity", 0)}
-            for chunk in sorted_results[:top_n]
-        ]
-        # Create system prompt
-        system_prompt = (
-            "You are a helpful assistant. Strictly follow these rules:"
-            "1. Only answer the user's question based on the provided context."
-            "2. Do NOT explain your process, logic, or how you answered."
-            "3. Do NOT list all sources, only answer concisely."
-            "4. If information is not in the context, say 'I don't have enough information.'"
-            "5. Use bullet points for lists."
-            "6. Maintain a professional tone."
-        )
+        selected = _select_context(results, max_tokens)
+        if "answer" in selected:
+            return selected
+        used_sources = selected["sources"]
         # Get completion from GROQ
         try:
-            completion = client.chat.completions.create(
-                model="qwen/qwen3-32b",  # Using faster model for better response time
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Question: {query}\n\nContext:\n{context}"}
-                ],
-                temperature=0.3,
-                max_tokens=max_tokens,
-                presence_penalty=0.3,
-                frequency_penalty=0.3,
-                top_p=1.0,           # Controls nucleus sampling, 1.0 = use all tokens
-                n=1,                 # Number of completions to generate
-                stop=None            # You can set stop sequences if needed, e.g. ["\n"]
+            completion = get_groq_client().chat.completions.create(
+                messages=_build_messages(query, selected["context"]),
+                **_completion_params(max_tokens)
             )
             
             answer = completion.choices[0].message.content
@@ -148,13 +241,50 @@ def summarize_themes(results: List[ChunkType], query: str, max_tokens: int = 800
         except Exception as gpt_error:
             logger.error(f"Error calling OpenAI API: {str(gpt_error)}")
             # Fallback to a simpler response using the most relevant chunk
-            if context_parts:
-                return {"answer": format_response("API Error. Here's the most relevant excerpt."), "sources": used_sources}
-            return {"answer": "Error generating response and no fallback content available.", "sources": []}
+            return {"answer": format_response("API Error. Here's the most relevant excerpt."), "sources": used_sources}
         
     except Exception as e:
         logger.error(f"Error in summarize_themes: {str(e)}")
         return {"answer": f"Error generating summary: {str(e)}", "sources": []}
 
+async def stream_themes(results: List[ChunkType], query: str, max_tokens: int = 800) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of summarize_themes.
+
+    Yields {"delta": str} events as the LLM generates the answer (with <think>
+    blocks removed), followed by one final {"answer": str, "sources": [...]} event
+    holding the formatted answer. The final event also carries "error" if the
+    completion failed.
+    """
+    try:
+        selected = _select_context(results, max_tokens)
+        if "answer" in selected:
+            yield selected
+            return
+        used_sources = selected["sources"]
 
+        stream = await get_async_groq_client().chat.completions.create(
+            messages=_build_messages(query, selected["context"]),
+            stream=True,
+            **_completion_params(max_tokens)
+        )
+        answer = ""
+        emitted = 0
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            answer += delta
+            visible = _visible_text(answer)
+            if len(visible) > emitted:
+                yield {"delta": visible[emitted:]}
+                emitted = len(visible)
 
+        if not answer:
+            yield {"answer": "Error: No response generated", "sources": used_sources, "error": "empty completion"}
+            return
+        yield {"answer": format_response(answer), "sources": used_sources}
+
+    except Exception as e:
+        logger.error(f"Error in stream_themes: {str(e)}")
+        yield {"answer": format_response("API Error. Here's the most relevant excerpt."), "sources": [], "error": str(e)}
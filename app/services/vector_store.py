@@ -6,41 +6,96 @@ It supports storing document chunks along with metadata and querying the most se
 """
 
 import os
+import hashlib
 import logging
+import threading
 import chromadb
-from groq import Groq
-from typing import List, Dict, Any, Optional, Union
+import torch
+from functools import lru_cache
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Union, Callable, Iterator
 from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from app.core.config import settings
 from dotenv import load_dotenv
+from .faiss_index import (
+    is_available as sidecar_available,
+    build_sidecar_index,
+    load_sidecar_index,
+    add_to_sidecar_index,
+    search_sidecar_index
+)
+from .embedding_cache import get_cached_embeddings
+from .embedding_workers import PoolModel
 from sentence_transformers import SentenceTransformer
 
 # Load environment variables
 load_dotenv()
 
-# Get GROQ API key
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY environment variable is not set")
-
 # Configure logging
 logger = logging.getLogger(__name__)
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
 
+# Query encodes run on ENCODE_POOL and uploads are embedded and stored on INGEST_POOL,
+# so a large ingest never holds the threads that answer queries. Each encoder thread
+# gets an equal share of the cores, so the pools together use every core once.
+ENCODE_WORKERS = 2
+INGEST_WORKERS = 1
+ENCODE_POOL = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="embed")
+INGEST_POOL = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+@lru_cache(maxsize=1)
+def get_embedder() -> SentenceTransformer:
+    """Load the sentence embedding model once per process, on a CUDA or Apple GPU when available."""
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // (ENCODE_WORKERS + INGEST_WORKERS)))
+    if torch.cuda.is_available():
+        device = "cuda"
+    elif torch.backends.mps.is_available():
+        device = "mps"
+    else:
+        device = "cpu"
+    if settings.EMBEDDING_BACKEND != "torch":
+        # ONNX Runtime / OpenVINO run an exported (optionally int8-quantized) graph instead of PyTorch
+        logger.info(f"Loading embedding model {settings.EMBEDDING_MODEL} with the {settings.EMBEDDING_BACKEND} backend")
+        model_kwargs = {"file_name": settings.EMBEDDING_MODEL_FILE} if settings.EMBEDDING_MODEL_FILE else None
+        return SentenceTransformer(
+            settings.EMBEDDING_MODEL,
+            device="cuda" if device == "cuda" else "cpu",  # No MPS execution provider
+            backend=settings.EMBEDDING_BACKEND,
+            model_kwargs=model_kwargs
+        )
+    logger.info(f"Loading embedding model {settings.EMBEDDING_MODEL} on {device}")
+    model = SentenceTransformer(settings.EMBEDDING_MODEL, device=device)
+    if device == "cuda":
+        # Half precision runs on tensor cores; embeddings are cast back to float32 downstream
+        model.half()
+    return model
+
+@lru_cache(maxsize=1)
+def get_client() -> chromadb.PersistentClient:
+    """Return the process-wide ChromaDB client, so the HNSW index stays warm across requests."""
+    # Ensure directory exists
+    os.makedirs(settings.CHROMA_DB_PATH, exist_ok=True)
+    return chromadb.PersistentClient(path=str(settings.CHROMA_DB_PATH))
+
+@lru_cache(maxsize=8)
+def get_collection(name: str = "docs"):
+    """Return a cached handle to a ChromaDB collection, creating it if needed."""
+    return get_client().get_or_create_collection(
+        name=name,
+        metadata={
+            "hnsw:space": "cosine",  # Use cosine similarity
+            # Graph parameters take effect when the collection is created
+            "hnsw:M": 16,
+            "hnsw:construction_ef": 200,
+            "hnsw:search_ef": 64
+        }
+    )
 
 def initialize_vector_store():
     """Initialize ChromaDB client with error handling"""
     try:
-        # Ensure directory exists
-        os.makedirs(settings.CHROMA_DB_PATH, exist_ok=True)
-        
-        # Initialize ChromaDB
-        client = chromadb.PersistentClient(path=str(settings.CHROMA_DB_PATH))
-        collection = client.get_or_create_collection(
-            name="docs",
-            metadata={"hnsw:space": "cosine"}  # Use cosine similarity
-        )
+        client = get_client()
+        collection = get_collection()
         
         logger.info(f"Successfully initialized ChromaDB at {settings.CHROMA_DB_PATH}")
         
@@ -50,10 +105,136 @@ def initialize_vector_store():
         raise
 
 # Initialize components
-client, collection = initialize_vector_store()
+initialize_vector_store()
+
+def warm_vector_store() -> None:
+    """
+    Pull the collection's files into the page cache and run one query, so the
+    HNSW index is loaded before the first user request rather than during it.
+    """
+    try:
+        if hasattr(os, "posix_fadvise"):
+            for root, _, files in os.walk(settings.CHROMA_DB_PATH):
+                for name in files:
+                    fd = os.open(os.path.join(root, name), os.O_RDONLY)
+                    try:
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                    finally:
+                        os.close(fd)
+
+        collection = get_collection()
+        if collection.count():
+            dimension = get_embedder().get_sentence_embedding_dimension()
+            # Any unit vector will do; a zero vector has no cosine distance
+            probe = [1.0] + [0.0] * (dimension - 1)
+            collection.query(query_embeddings=[probe], n_results=1, include=[])
+        logger.info("Warmed up vector store")
+    except Exception as e:
+        logger.error(f"Error warming up vector store: {str(e)}")
+
+def refresh_sidecar_index() -> None:
+    """Load the FAISS sidecar if it matches the collection, otherwise rebuild it."""
+    if not sidecar_available():
+        return
+    collection = get_collection()
+    if not load_sidecar_index(collection.count()):
+        build_sidecar_index(collection)
+
+def rebuild_sidecar_index() -> None:
+    """Rebuild the FAISS sidecar from the collection, e.g. periodically or by hand."""
+    if sidecar_available():
+        build_sidecar_index(get_collection())
+
+# Sidecar loads and rebuilds run one at a time on their own thread, away from the
+# default executor that query handlers search on
+SIDECAR_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sidecar")
+_rebuild_queued = False
+_rebuild_queued_lock = threading.Lock()
+
+def _queued_rebuild() -> None:
+    global _rebuild_queued
+    with _rebuild_queued_lock:
+        _rebuild_queued = False
+    rebuild_sidecar_index()
+
+def request_sidecar_rebuild() -> None:
+    """
+    Rebuild the sidecar in the background. Requests made while a rebuild is waiting
+    to start are collapsed into it; one made while a rebuild runs queues one more,
+    which then reads everything stored in the meantime.
+    """
+    global _rebuild_queued
+    if not sidecar_available():
+        return
+    with _rebuild_queued_lock:
+        if _rebuild_queued:
+            return
+        _rebuild_queued = True
+    SIDECAR_POOL.submit(_queued_rebuild)
 
 Embedding = List[float]
 
+# Chunks encoded per step when storing; large ingests overlap encoding with inserts
+INGEST_WINDOW = 2048
+# Encoder calls with more uncached chunks than this use a process per CPU core or GPU
+MULTI_PROCESS_MIN_CHUNKS = 1000
+
+def _encode(texts: List[str]) -> np.ndarray:
+    """Run the embedding model over texts, normalized so cached vectors are interchangeable."""
+    # Stays a matrix; the embedding cache converts rows to lists once for ChromaDB
+    with torch.inference_mode():
+        return get_embedder().encode(
+            texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True
+        )
+
+@contextmanager
+def _ingest_encoder() -> Iterator[Callable[[List[str]], np.ndarray]]:
+    """
+    Yield the encode function for one ingest. Batches of more than
+    MULTI_PROCESS_MIN_CHUNKS uncached texts are spread over one single-threaded worker
+    process per CPU core, or one per GPU on multi-GPU machines; the pool is started on
+    first need and stopped when the ingest ends.
+
+    The pool is started from its own copy of the model: starting one moves the model
+    to the CPU and into shared memory, which must not happen to the copy that
+    get_embedder() serves queries with.
+    """
+    embedder = get_embedder()
+    if settings.EMBEDDING_BACKEND != "torch":
+        devices = []
+    elif embedder.device.type == "cuda":
+        devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    elif embedder.device.type == "cpu":
+        devices = ["cpu"] * (os.cpu_count() or 1)
+    else:
+        devices = []
+    parallel = len(devices) > 1
+    pool_model = None
+    pool = None
+
+    def encode(texts: List[str]) -> np.ndarray:
+        nonlocal pool_model, pool
+        if not parallel or len(texts) <= MULTI_PROCESS_MIN_CHUNKS:
+            return _encode(texts)
+        if pool is None:
+            logger.info(f"Starting {len(devices)} embedding worker processes")
+            pool_model = PoolModel(settings.EMBEDDING_MODEL, device="cpu")
+            if embedder.device.type == "cuda":
+                # Workers move their copy to their GPU as is, so match the query model's precision
+                pool_model.half()
+            else:
+                # One process per core already uses every core; more threads would oversubscribe them
+                pool_model.worker_threads = 1
+            pool = pool_model.start_multi_process_pool(target_devices=devices)
+        with torch.inference_mode():
+            return pool_model.encode_multi_process(texts, pool, batch_size=64, normalize_embeddings=True)
+
+    try:
+        yield encode
+    finally:
+        if pool is not None:
+            pool_model.stop_multi_process_pool(pool)
+
 def get_embeddings(texts: List[str]) -> List[List[float]]:
     """Get embeddings using Sentence Transformers  """
     try:
@@ -70,21 +251,8 @@ def get_embeddings(texts: List[str]) -> List[List[float]]:
             logger.warning("No valid text to embed after cleaning")
             return []
             
-        # Create GROQ client
-        if not api_key:
-            raise ValueError("GROQ API key is not set")
-        client = Groq(api_key=api_key)
-
-        # Get embeddings from GROQ
-        # response = client.embeddings.create(
-        # model="text-embedding-ada-002",
-        #     input=validated_texts
-        # )
-        # Load model once globally (do this at top of file)
-        embedder = SentenceTransformer("all-MiniLM-L6-v2")  # lightweight, fast model
-
-# Instead of calling Groq
-        embeddings = embedder.encode(validated_texts, convert_to_tensor=False).tolist()
+        # Only text that has not been embedded before reaches the model
+        embeddings = get_cached_embeddings(validated_texts, _encode)
         return embeddings
     except Exception as e:
         logger.error(f"Error getting embeddings from OpenAI: {str(e)}")
@@ -118,126 +286,176 @@ def store_text_chunks(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
     Returns:
         Dict: Status of the storage operation
     """
+    return store_text_chunks_batch(chunks)
+
+def _store_window(collection, ids: List[str], embeddings: List[Embedding], documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+    """Upsert one window of chunks, then add them to the FAISS sidecar."""
+    collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+    if not add_to_sidecar_index(ids, embeddings, documents, metadatas):
+        request_sidecar_rebuild()
+
+def _chunk_id(chunk: Dict[str, Any]) -> str:
+    """Deterministic id for a chunk, so storing the same chunk again is a no-op."""
+    key = "\0".join([str(chunk['meta'].get('source', '')), chunk['content']])
+    return f"c_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+def store_text_chunks_batch(chunks: List[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Stores chunks from any number of documents. Chunks already in the collection
+    (same source and content) are skipped. Up to INGEST_WINDOW new chunks are
+    embedded and upserted in one step; larger ingests upsert each window while
+    the next one is being embedded.
+
+    Args:
+        chunks (List[Dict]): Chunks with 'content' and 'meta', possibly from several files
+        batch_size (Optional[int]): Maximum chunks per upsert; defaults to ChromaDB's limit, capped at INGEST_WINDOW
+
+    Returns:
+        Dict: Status of the storage operation, including the chunk ids in input order
+    """
     try:
         if not chunks:
             return {"status": "error", "message": "No chunks provided"}
 
-        # Get current collection size for ID generation
-        current_size = len(collection.get()['ids'])
-        
+        collection = get_collection()
+
         # Prepare batch data
         contents = [chunk['content'] for chunk in chunks]
-        metadatas = [chunk['meta'] for chunk in chunks]
-        ids = [f"chunk_{current_size + i}" for i in range(len(chunks))]
+        # Sources are matched case-insensitively, so each chunk also stores its source lowercased
+        metadatas = [
+            {**chunk['meta'], 'source_key': str(chunk['meta'].get('source', '')).lower()}
+            for chunk in chunks
+        ]
+        # Ids derived from source and content make re-ingesting a chunk idempotent
+        ids = [_chunk_id(chunk) for chunk in chunks]
+        window_size = min(
+            batch_size or getattr(get_client(), "max_batch_size", len(chunks)) or len(chunks),
+            INGEST_WINDOW
+        )
 
-        # Process in batches
-        total_chunks = len(chunks)
-        processed = 0
-        batch_size = settings.BATCH_SIZE
+        # Only chunks that are neither stored yet nor repeated earlier in this batch are written
+        unique_ids = list(dict.fromkeys(ids))
+        existing = set()
+        for start in range(0, len(unique_ids), window_size):
+            existing.update(collection.get(ids=unique_ids[start:start + window_size], include=[])['ids'])
+        new_positions = []
+        for i, id_ in enumerate(ids):
+            if id_ not in existing:
+                existing.add(id_)
+                new_positions.append(i)
+        total_chunks = len(new_positions)
 
-        while processed < total_chunks:
-            batch_end = min(processed + batch_size, total_chunks)
-            batch_slice = slice(processed, batch_end)
-            
-            batch_contents = contents[batch_slice]
-            batch_metadatas = metadatas[batch_slice]
-            batch_ids = ids[batch_slice]
+        # Encode window i+1 on this thread while a writer thread upserts window i;
+        # the encoder and ChromaDB's SQLite/HNSW writes both release the GIL
+        with _ingest_encoder() as encode, ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for start in range(0, total_chunks, window_size):
+                window = new_positions[start:start + window_size]
+                try:
+                    # Reuse cached vectors for text seen before
+                    embeddings = get_cached_embeddings([contents[i] for i in window], encode)
+                except Exception as e:
+                    logger.error(f"Error generating embeddings for batch: {str(e)}")
+                    return {"status": "error", "message": f"Embedding generation failed: {str(e)}"}
 
-            # Generate embeddings for the batch using OpenAI
-            try:
-                batch_embeddings = get_embeddings(batch_contents)
-            except Exception as e:
-                logger.error(f"Error generating embeddings for batch: {str(e)}")
-                return {"status": "error", "message": f"OpenAI embedding generation failed: {str(e)}"}
+                try:
+                    if pending is not None:
+                        pending.result()
+                    pending = writer.submit(
+                        _store_window,
+                        collection,
+                        [ids[i] for i in window],
+                        embeddings,
+                        [contents[i] for i in window],
+                        [metadatas[i] for i in window]
+                    )
+                except Exception as e:
+                    logger.error(f"Error adding batch to ChromaDB: {str(e)}")
+                    return {"status": "error", "message": f"ChromaDB storage failed: {str(e)}"}
 
-            # Add to ChromaDB
             try:
-                # Convert embeddings to numpy array for ChromaDB
-                embeddings_array = np.array([np.array(emb, dtype=np.float64) for emb in batch_embeddings])
-                collection.add(
-                    embeddings=embeddings_array.tolist(),  # ChromaDB expects List[List[float]]
-                    documents=batch_contents,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
-                processed += len(batch_contents)
-                logger.info(f"Processed {processed}/{total_chunks} chunks")
-                 
-            
+                if pending is not None:
+                    pending.result()
             except Exception as e:
                 logger.error(f"Error adding batch to ChromaDB: {str(e)}")
                 return {"status": "error", "message": f"ChromaDB storage failed: {str(e)}"}
 
+        logger.info(f"Stored {total_chunks} new chunks, skipped {len(chunks) - total_chunks} already stored")
+
         return {
             "status": "success",
             "message": f"Successfully stored {total_chunks} chunks",
-            "chunks_stored": total_chunks
-            
+            "chunks_stored": total_chunks,
+            "ids": ids
         }
-        print("total_chunks", total_chunks)
-        print("processed", processed, "unprocessed", total_chunks - processed)
 
     except Exception as e:
-        logger.error(f"Error in store_text_chunks: {str(e)}")
+        logger.error(f"Error in store_text_chunks_batch: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+# Fields every similarity query fetches, built once rather than per query
+_QUERY_INCLUDE = ["documents", "metadatas", "distances"]
+
 # Alias for backward compatibility
 def search_similar(query_text: str, n_results: int = 10) -> List[Dict[str, Any]]:
     return query_similar_chunks(query_text, n_results)
 
-def query_similar_chunks(query_text: str, n_results: int = 10) -> List[Dict[str, Any]]:
+def query_similar_chunks(
+    query_text: str,
+    n_results: int = 10,
+    where: Optional[Dict[str, Any]] = None,
+    query_embedding: Optional[Embedding] = None
+) -> List[Dict[str, Any]]:
     """
     Query the vector store for chunks similar to the input text.
     
     Args:
         query_text (str): The text to find similar chunks for
         n_results (int): Number of results to return
+        where (Optional[Dict]): Metadata filter applied by ChromaDB, e.g. {"source": "file.pdf"}
+        query_embedding (Optional[Embedding]): Precomputed embedding of query_text, to avoid encoding it again
         
     Returns:
         List[Dict]: List of similar chunks with their metadata and similarity scores
     """
     try:
-        # Generate query embedding using OpenAI
-        query_embedding = get_embeddings([query_text])[0]
+        # Generate query embedding unless the caller already has one
+        if query_embedding is None:
+            query_embedding = get_embeddings([query_text])[0]
         
+        # Unfiltered queries are served from the FAISS sidecar when a fresh one is loaded
+        if where is None:
+            sidecar_results = search_sidecar_index(query_embedding, n_results)
+            if sidecar_results is not None:
+                return sidecar_results
+
         # Query the collection
         try:
-            results = collection.query(
+            results = get_collection().query(
                 query_embeddings=[query_embedding],
                 n_results=n_results,
-                include=["documents", "metadatas", "distances"]
+                where=where,
+                include=_QUERY_INCLUDE
             )
         except Exception as e:
             logger.error(f"ChromaDB query failed: {str(e)}")
             return []
 
         # Format results
-        formatted_results = []
         try:
-            if results and isinstance(results, dict):
-                # Safely get results
-                ids_list = results.get('ids', [])
-                docs_list = results.get('documents', [])
-                meta_list = results.get('metadatas', [])
-                dist_list = results.get('distances', [])
-
-                if ids_list and len(ids_list) > 0:
-                    ids = ids_list[0]
-                    documents = docs_list[0] if docs_list else []
-                    metadatas = meta_list[0] if meta_list else []
-                    distances = dist_list[0] if dist_list else []
-
-                    for i in range(len(ids)):
-                        formatted_results.append({
-                            "content": documents[i] if i < len(documents) else "",
-                            "metadata": metadatas[i] if i < len(metadatas) else {},
-                            "similarity": 1 - float(distances[i]) if i < len(distances) else 0.0
-                        })
+            # ChromaDB returns one list per query embedding; we send exactly one
+            documents = (results.get('documents') or [[]])[0]
+            metadatas = (results.get('metadatas') or [[]])[0]
+            distances = (results.get('distances') or [[]])[0]
+
+            # Parallel lists, already ordered by ascending distance
+            return [
+                {"content": document, "metadata": metadata or {}, "similarity": 1 - float(distance)}
+                for document, metadata, distance in zip(documents, metadatas, distances)
+            ]
         except Exception as e:
             logger.error(f"Error formatting results: {str(e)}")
             return []
-            
-        return formatted_results
         
     except Exception as e:
         logger.error(f"Error querying vector store: {str(e)}")
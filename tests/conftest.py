@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when app.core.config is imported, so point the vector store,
+# caches and manifest at a scratch directory before any test imports the app
+_DATA_DIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ.setdefault("CHROMA_DB_PATH", os.path.join(_DATA_DIR, "chroma_db"))
+os.environ.setdefault("EMBED_CACHE_PATH", os.path.join(_DATA_DIR, "chroma_db", "embedding_cache.sqlite"))
+os.environ.setdefault("SEMANTIC_CACHE_PATH", os.path.join(_DATA_DIR, "chroma_db", "semantic_cache"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from app.services import semantic_cache as semantic_cache_module
+from app.services.semantic_cache import SemanticCache
+
+def test_saved_cache_is_reloaded_for_the_same_model(tmp_path):
+    cache = SemanticCache(path=str(tmp_path / "cache"))
+    cache.add(np.array([1.0, 0.0, 0.0], dtype=np.float32), "answer", ["a.pdf"])
+    cache.save()
+
+    reloaded = SemanticCache(path=str(tmp_path / "cache"))
+    reloaded.load()
+
+    assert reloaded.lookup(np.array([1.0, 0.0, 0.0], dtype=np.float32))["answer"] == "answer"
+
+def test_saved_cache_from_another_model_is_discarded(tmp_path, monkeypatch):
+    cache = SemanticCache(path=str(tmp_path / "cache"))
+    cache.add(np.array([1.0, 0.0, 0.0], dtype=np.float32), "answer", ["a.pdf"])
+    cache.save()
+
+    # A model with a different embedding size is configured
+    monkeypatch.setattr(semantic_cache_module, "MODEL_KEY", "other-model:torch:")
+    reloaded = SemanticCache(path=str(tmp_path / "cache"))
+    reloaded.load()
+
+    assert reloaded.lookup(np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)) is None
@@ -0,0 +1,30 @@
+import os
+import uuid
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from app.services import vector_store
+
+def test_large_ingest_keeps_query_embedder_on_its_device(monkeypatch):
+    embedder = vector_store.get_embedder()
+    device = embedder.device
+    dtype = next(embedder.parameters()).dtype
+
+    # Force the multi-process path with a small pool
+    monkeypatch.setattr(vector_store, "MULTI_PROCESS_MIN_CHUNKS", 2)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    run = uuid.uuid4().hex
+    chunks = [
+        {"content": f"chunk {i} of ingest {run}", "meta": {"source": "large.txt", "chunk_index": i}}
+        for i in range(8)
+    ]
+
+    result = vector_store.store_text_chunks_batch(chunks)
+
+    assert result["status"] == "success"
+    assert result["chunks_stored"] == len(chunks)
+    assert embedder.device == device
+    assert next(embedder.parameters()).dtype == dtype
+    assert vector_store.get_embedder() is embedder